@@ -6,45 +6,60 @@ A Flask application for rendering Manim scripts in Google Cloud Run
 
 import os
 import sys
+import asyncio
+import re
 import json
 import uuid
+import hashlib
+import tarfile
 import time
 import tempfile
 import subprocess
+import shutil
+import queue
 import logging
+import threading
+import functools
+import multiprocessing
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Any, Optional, Tuple
 
 from flask import Flask, request, jsonify, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from google.cloud import storage, monitoring_v3, logging as cloud_logging
+from google.cloud.storage import transfer_manager
+from google.api_core.exceptions import NotFound
 from google.auth import default
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import structlog
 
-# Configure structured logging
-structlog.configure(
-    processors=[
-        structlog.stdlib.filter_by_level,
-        structlog.stdlib.add_logger_name,
-        structlog.stdlib.add_log_level,
-        structlog.stdlib.PositionalArgumentsFormatter(),
-        structlog.processors.TimeStamper(fmt="iso"),
-        structlog.processors.StackInfoRenderer(),
-        structlog.processors.format_exc_info,
-        structlog.processors.UnicodeDecoder(),
-        structlog.processors.JSONRenderer()
-    ],
-    context_class=dict,
-    logger_factory=structlog.stdlib.LoggerFactory(),
-    wrapper_class=structlog.stdlib.BoundLogger,
-    cache_logger_on_first_use=True,
-)
+import render_worker
 
-logger = structlog.get_logger()
+# Structured logging is configured by render_worker so the render processes
+# log exactly like the web process
+render_worker.configure_logging()
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson's C encoder"""
+    
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(
+            obj,
+            default=self.default,
+            option=orjson.OPT_NON_STR_KEYS
+        ).decode('utf-8')
+    
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
 
 # Initialize Flask app
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
 # Configuration
@@ -55,38 +70,306 @@ class Config:
     SERVICE_NAME = os.getenv('K_SERVICE', 'manim-renderer')
     REVISION = os.getenv('K_REVISION', 'unknown')
     
-    # Directories
-    OUTPUT_DIR = Path('/app/output')
-    TEMP_DIR = Path('/app/temp')
+    # Directories. Render scratch lives under the system temp dir (honours
+    # TMPDIR); Cloud Run's writable filesystem is in memory, so Manim's
+    # frame and mux IO never touches a disk
+    SCRATCH_DIR = Path(tempfile.gettempdir()) / 'manim'
+    OUTPUT_DIR = SCRATCH_DIR / 'output'
+    TEMP_DIR = SCRATCH_DIR / 'temp'
     LOGS_DIR = Path('/app/logs')
     
     # Rendering settings
     MAX_RENDER_TIME = int(os.getenv('MAX_RENDER_TIME', '3600'))  # 1 hour
     DEFAULT_QUALITY = os.getenv('DEFAULT_QUALITY', 'medium_quality')
     DEFAULT_FORMAT = os.getenv('DEFAULT_FORMAT', 'mp4')
+    RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '2'))
+    SWEEP_INTERVAL = int(os.getenv('SWEEP_INTERVAL', '300'))  # 5 minutes
+    METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', '10'))
+    
+    # Upload settings
+    UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(32 * 1024 * 1024)))  # 32 MiB
+    UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '8'))
+    UPLOAD_RESUMABLE_CHUNK_SIZE = 8 * 1024 * 1024  # 8 MiB, a multiple of 256 KiB
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '64'))
+    BUNDLE_CHUNK_SIZE = 32 * 1024 * 1024  # 32 MiB resumable upload chunks
+    RENDER_CACHE_ENABLED = os.getenv('RENDER_CACHE_ENABLED', 'true').lower() == 'true'
 
 config = Config()
 
+# Shared logger with the process-wide context bound once; request handlers
+# bind request_id on top of it, and render workers get the same context
+_LOG_CONTEXT = {
+    'service': config.SERVICE_NAME,
+    'revision': config.REVISION,
+    'project_id': config.PROJECT_ID
+}
+logger = structlog.get_logger().bind(**_LOG_CONTEXT)
+
 # Ensure directories exist
 for directory in [config.OUTPUT_DIR, config.TEMP_DIR, config.LOGS_DIR]:
     directory.mkdir(parents=True, exist_ok=True)
 
-# Initialize Google Cloud clients
-try:
+def _sweep_scratch_dirs():
+    """Remove render leftovers older than twice the render timeout"""
+    while True:
+        time.sleep(config.SWEEP_INTERVAL)
+        cutoff = time.time() - config.MAX_RENDER_TIME * 2
+        for directory in [config.OUTPUT_DIR, config.TEMP_DIR]:
+            # A failed listing skips this pass instead of ending the thread
+            try:
+                paths = list(directory.iterdir())
+            except OSError as e:
+                logger.warning("Failed to list scratch directory", path=str(directory), error=str(e))
+                continue
+            for path in paths:
+                try:
+                    if path.stat().st_mtime >= cutoff:
+                        continue
+                    if path.is_dir():
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        path.unlink(missing_ok=True)
+                    logger.info("Swept stale render data", path=str(path))
+                except OSError as e:
+                    logger.warning("Failed to sweep render data", path=str(path), error=str(e))
+
+# Background sweeper so scratch usage is bounded by concurrent jobs rather
+# than total jobs served, even when a render dies before its own cleanup
+threading.Thread(target=_sweep_scratch_dirs, name='scratch-sweeper', daemon=True).start()
+
+def _build_storage_session(credentials) -> AuthorizedSession:
+    """
+    Build the HTTP session shared by every GCS request, with a keep-alive
+    pool large enough for concurrent chunk uploads to reuse connections
+    instead of paying a TLS handshake per upload
+    """
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(
+        pool_connections=config.HTTP_POOL_SIZE,
+        pool_maxsize=config.HTTP_POOL_SIZE,
+        # Only connection setup is retried here; the storage library
+        # already retries the upload requests themselves
+        max_retries=Retry(connect=3, read=0, status=0, backoff_factor=0.5)
+    )
+    session.mount('https://', adapter)
+    return session
+
+# Google Cloud clients are created on first use rather than at import, so
+# a cold start is not held up by credential lookups and channel setup. A
+# client that fails to initialize is cached as None and its feature is
+# skipped, as before.
+@functools.lru_cache(maxsize=1)
+def _get_credentials():
     credentials, project = default()
-    storage_client = storage.Client(project=config.PROJECT_ID, credentials=credentials)
-    monitoring_client = monitoring_v3.MetricServiceClient(credentials=credentials)
-    cloud_logging_client = cloud_logging.Client(project=config.PROJECT_ID, credentials=credentials)
+    return credentials
+
+@functools.lru_cache(maxsize=1)
+def _get_storage_client() -> Optional[storage.Client]:
+    try:
+        credentials = _get_credentials()
+        client = storage.Client(
+            project=config.PROJECT_ID,
+            credentials=credentials,
+            _http=_build_storage_session(credentials)
+        )
+        logger.info("Cloud Storage client initialized")
+        return client
+    except Exception as e:
+        logger.error("Failed to initialize Cloud Storage client", error=str(e))
+        return None
+
+@functools.lru_cache(maxsize=1)
+def _get_monitoring_client() -> Optional[monitoring_v3.MetricServiceClient]:
+    try:
+        client = monitoring_v3.MetricServiceClient(credentials=_get_credentials())
+        logger.info("Cloud Monitoring client initialized")
+        return client
+    except Exception as e:
+        logger.error("Failed to initialize Cloud Monitoring client", error=str(e))
+        return None
+
+@functools.lru_cache(maxsize=1)
+def _get_logging_client() -> Optional[cloud_logging.Client]:
+    try:
+        client = cloud_logging.Client(project=config.PROJECT_ID, credentials=_get_credentials())
+        logger.info("Cloud Logging client initialized")
+        return client
+    except Exception as e:
+        logger.error("Failed to initialize Cloud Logging client", error=str(e))
+        return None
+
+# Render reports (render_time, file_size, success, timestamp) waiting to be
+# written to Cloud Monitoring by the background flusher, so the gRPC call
+# never sits on the request path
+_METRIC_QUEUE = queue.Queue()
+_METRIC_BATCH_SIZE = 200  # Most reports folded into a single write
+_METRIC_RETRIES = 4
+
+def _build_time_series(metric_type: str, status: str, end_time: float, value) -> monitoring_v3.TimeSeries:
+    """One point of a custom metric, labelled with the render status"""
+    seconds = int(end_time)
+    nanos = int((end_time - seconds) * 10 ** 9)
+    
+    series = monitoring_v3.TimeSeries()
+    series.metric.type = metric_type
+    series.metric.labels["status"] = status
+    series.resource.type = "cloud_run_revision"
+    series.resource.labels["service_name"] = config.SERVICE_NAME
+    series.resource.labels["revision_name"] = config.REVISION
+    
+    point = monitoring_v3.Point()
+    if isinstance(value, int):
+        point.value.int64_value = value
+    else:
+        point.value.double_value = value
+    point.interval = monitoring_v3.TimeInterval({
+        "end_time": {"seconds": seconds, "nanos": nanos}
+    })
+    series.points = [point]
+    return series
+
+def _write_metrics(reports):
+    """Write a batch of render reports to Google Cloud Monitoring"""
+    project_name = f"projects/{config.PROJECT_ID}"
+    
+    # A time series accepts a single point per write, so successes and
+    # failures go to separate series (status label): a render count, and
+    # the mean render time within that status only, so quick validation
+    # failures never skew the render time of real renders
+    time_series = []
+    for status, succeeded in (("success", True), ("failure", False)):
+        group = [report for report in reports if report[2] == succeeded]
+        if not group:
+            continue
+        end_time = group[-1][3]
+        render_time = sum(report[0] for report in group) / len(group)
+        time_series.append(_build_time_series(
+            "custom.googleapis.com/manim/render_time", status, end_time, render_time
+        ))
+        time_series.append(_build_time_series(
+            "custom.googleapis.com/manim/render_count", status, end_time, len(group)
+        ))
+    
+    monitoring_client = _get_monitoring_client()
+    if not monitoring_client:
+        return
+    
+    # Send metrics, backing off exponentially between attempts
+    for attempt in range(_METRIC_RETRIES):
+        try:
+            monitoring_client.create_time_series(
+                name=project_name,
+                time_series=time_series
+            )
+            return
+        except Exception as e:
+            if attempt == _METRIC_RETRIES - 1:
+                logger.error("Failed to report metrics", error=str(e), reports=len(reports))
+                return
+            time.sleep(2 ** attempt)
+
+def _metric_flusher():
+    """Drain queued render reports every METRICS_FLUSH_INTERVAL seconds"""
+    while True:
+        reports = [_METRIC_QUEUE.get()]
+        deadline = time.monotonic() + config.METRICS_FLUSH_INTERVAL
+        while len(reports) < _METRIC_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                reports.append(_METRIC_QUEUE.get(timeout=timeout))
+            except queue.Empty:
+                break
+        try:
+            _write_metrics(reports)
+        except Exception as e:
+            logger.error("Failed to report metrics", error=str(e), reports=len(reports))
+
+threading.Thread(target=_metric_flusher, name='metric-flusher', daemon=True).start()
+
+# Each render runs in its own process from a forkserver that preloads manim
+# and render_worker, so it starts warm and single-threaded rather than as a
+# fork of this threaded web worker. Nothing a script changes in Manim
+# outlives its render, and a render that dies or hangs is killed on its own
+# without affecting the others.
+_RENDER_CONTEXT = multiprocessing.get_context('forkserver')
+_RENDER_CONTEXT.set_forkserver_preload(['manim', 'render_worker'])
+_RENDER_SLOTS = threading.BoundedSemaphore(config.RENDER_WORKERS)
+_RENDER_KILL_GRACE = 30  # seconds past MAX_RENDER_TIME before the kill
+
+def _run_render_process(*args) -> Dict[str, Any]:
+    """Run render_worker.render_in_child in a fresh process under a hard deadline"""
+    with _RENDER_SLOTS:
+        parent_conn, child_conn = _RENDER_CONTEXT.Pipe(duplex=False)
+        process = _RENDER_CONTEXT.Process(
+            target=render_worker.run_render,
+            args=(child_conn, _LOG_CONTEXT, *args),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        try:
+            # The child's own SIGALRM can be disabled by the script, so the
+            # deadline is enforced here as well
+            if not parent_conn.poll(config.MAX_RENDER_TIME + _RENDER_KILL_GRACE):
+                process.kill()
+                raise TimeoutError(f"Rendering timeout after {config.MAX_RENDER_TIME} seconds")
+            try:
+                status, payload = parent_conn.recv()
+            except EOFError:
+                process.join()
+                raise RuntimeError(
+                    f"Render worker process died unexpectedly (exit code {process.exitcode})"
+                )
+        finally:
+            parent_conn.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+                process.join()
     
-    # Setup cloud logging handler
-    cloud_logging_client.setup_logging()
+    if status == 'timeout':
+        raise TimeoutError(f"Rendering timeout after {config.MAX_RENDER_TIME} seconds")
+    if status == 'error':
+        raise RuntimeError(payload)
+    return payload
+
+def _detect_hw_encoder() -> Optional[str]:
+    """Return the hardware H.264 encoder ffmpeg can use on this host, if any"""
+    if Path('/dev/nvidia0').exists():
+        candidate = 'h264_nvenc'
+    elif Path('/dev/dri/renderD128').exists():
+        candidate = 'h264_vaapi'
+    else:
+        return None
     
-    logger.info("Google Cloud clients initialized", project_id=config.PROJECT_ID)
-except Exception as e:
-    logger.error("Failed to initialize Google Cloud clients", error=str(e))
-    storage_client = None
-    monitoring_client = None
-    cloud_logging_client = None
+    try:
+        encoders = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-encoders'],
+            capture_output=True,
+            text=True,
+            timeout=10
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    
+    return candidate if candidate in encoders else None
+
+# Detected once at startup and passed to each render
+_HW_ENCODER = _detect_hw_encoder()
+_PIGZ = shutil.which('pigz')
+
+logger.info("Video encoder selected", hw_encoder=_HW_ENCODER or 'none')
+
+# Script validation patterns, compiled once so each check is a single scan.
+# Dangerous tokens match anywhere, like the substring checks they replace,
+# so 'open' still catches os.popen and 'exec' catches the os.exec* family
+_DANGEROUS_RE = re.compile(
+    r'subprocess|os\.system|eval|exec\w*|popen|open|__import__|compile|globals|locals'
+)
+_MANIM_IMPORT_RE = re.compile(r'^\s*(?:from\s+manim\s+import|import\s+manim\b)', re.M)
+_SCENE_CLASS_RE = re.compile(r'class\s+\w+\s*\([^)]*Scene')
 
 class ManimRenderer:
     """
@@ -94,10 +377,15 @@ class ManimRenderer:
     """
     
     def __init__(self):
-        self.storage_client = storage_client
         self.bucket_name = config.BUCKET_NAME
         self.output_dir = config.OUTPUT_DIR
         self.temp_dir = config.TEMP_DIR
+    
+    @functools.cached_property
+    def bucket(self) -> Optional[storage.Bucket]:
+        """Bucket handle, resolved on first use; None without a storage client"""
+        storage_client = _get_storage_client()
+        return storage_client.bucket(self.bucket_name) if storage_client else None
         
     def validate_script(self, script_content: str) -> Tuple[bool, str]:
         """
@@ -105,21 +393,16 @@ class ManimRenderer:
         """
         try:
             # Basic security checks
-            dangerous_imports = [
-                'subprocess', 'os.system', 'eval', 'exec', 'open',
-                '__import__', 'compile', 'globals', 'locals'
-            ]
-            
-            for dangerous in dangerous_imports:
-                if dangerous in script_content:
-                    return False, f"Dangerous function/import detected: {dangerous}"
+            dangerous = _DANGEROUS_RE.search(script_content)
+            if dangerous:
+                return False, f"Dangerous function/import detected: {dangerous.group(0)}"
             
             # Check for required Manim imports
-            if 'from manim import' not in script_content and 'import manim' not in script_content:
+            if not _MANIM_IMPORT_RE.search(script_content):
                 return False, "Script must import manim"
             
             # Check for Scene class
-            if 'class' not in script_content or 'Scene' not in script_content:
+            if not _SCENE_CLASS_RE.search(script_content):
                 return False, "Script must contain a Scene class"
             
             return True, "Script validation passed"
@@ -127,13 +410,14 @@ class ManimRenderer:
         except Exception as e:
             return False, f"Validation error: {str(e)}"
     
-    def render_script(
+    async def render_script(
         self, 
         script_content: str, 
         request_id: str,
         quality: str = None,
         format: str = None,
-        scene_name: str = None
+        scene_name: str = None,
+        include_artifacts: bool = False
     ) -> Dict[str, Any]:
         """
         Render a Manim script and return the result
@@ -141,6 +425,7 @@ class ManimRenderer:
         start_time = time.time()
         quality = quality or config.DEFAULT_QUALITY
         format = format or config.DEFAULT_FORMAT
+        log = logger.bind(request_id=request_id)
         
         # Map quality names to Manim CLI quality flags
         quality_mapping = {
@@ -154,13 +439,13 @@ class ManimRenderer:
         # Get the correct quality flag
         quality_flag = quality_mapping.get(quality, 'm')  # default to medium
         
-        logger.info(
+        log.info(
             "Starting render",
-            request_id=request_id,
             quality=quality,
             quality_flag=quality_flag,
             format=format,
-            scene_name=scene_name
+            scene_name=scene_name,
+            include_artifacts=include_artifacts
         )
         
         try:
@@ -169,86 +454,104 @@ class ManimRenderer:
             if not is_valid:
                 raise ValueError(f"Script validation failed: {validation_message}")
             
-            # Create temporary script file
-            script_file = self.temp_dir / f"script_{request_id}.py"
-            with open(script_file, 'w', encoding='utf-8') as f:
-                f.write(script_content)
+            # Identical submissions are served from the content-addressed
+            # cache, unless the caller needs the full render tree
+            cache_blob_name = None
+            if self.bucket and config.RENDER_CACHE_ENABLED and not include_artifacts:
+                cache_key = hashlib.sha256(
+                    f"{script_content}|{quality_flag}|{format}|{scene_name}".encode('utf-8')
+                ).hexdigest()
+                cache_blob_name = f"cache/{cache_key}.{format}"
+                cached = self._lookup_cached_render(cache_blob_name)
+                if cached:
+                    log.info(
+                        "Render served from cache",
+                        blob_name=cache_blob_name
+                    )
+                    return {
+                        'success': True,
+                        'cached': True,
+                        'request_id': request_id,
+                        'video_file': None,
+                        'gcs_url': f"gs://{self.bucket_name}/{cache_blob_name}",
+                        'blob_name': cache_blob_name,
+                        'file_size': cached.size,
+                        'render_time': time.time() - start_time,
+                        'quality': quality,
+                        'format': format,
+                        'scene_name': scene_name,
+                        'timestamp': datetime.utcnow().isoformat(),
+                        'stdout': '',
+                        'stderr': ''
+                    }
             
             # Prepare output directory for this render
             render_output_dir = self.output_dir / request_id
             render_output_dir.mkdir(exist_ok=True)
-            
-            # Build manim command
-            cmd = [
-                'manim',
-                str(script_file),
-                '--output_file', f'video_{request_id}',
-                '--media_dir', str(render_output_dir),
-                '--quality', quality_flag,
-                '--format', format,
-                '--disable_caching'
-            ]
-            
-            if scene_name:
-                cmd.append(scene_name)
-            
-            logger.info("Executing manim command", command=' '.join(cmd))
-            
-            # Execute manim rendering
-            process = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=config.MAX_RENDER_TIME,
-                cwd=str(self.temp_dir)
+
+            # Render in a separate process, waited on from a thread so the
+            # request's event loop is not blocked
+            loop = asyncio.get_running_loop()
+            render = await loop.run_in_executor(
+                None,
+                _run_render_process,
+                script_content,
+                str(render_output_dir),
+                request_id,
+                quality_flag,
+                format,
+                scene_name,
+                str(self.temp_dir),
+                config.MAX_RENDER_TIME,
+                _HW_ENCODER
             )
-            
-            if process.returncode != 0:
-                error_msg = f"Manim rendering failed: {process.stderr}"
-                logger.error("Render failed", error=error_msg, stdout=process.stdout)
-                raise RuntimeError(error_msg)
-            
-            # Find the rendered video file
-            video_files = list(render_output_dir.rglob(f'*.{format}'))
-            if not video_files:
-                raise RuntimeError("No video file found after rendering")
-            
-            video_file = video_files[0]  # Take the first video file found
-            
+
+            video_file = Path(render['video_file'])
+
             # Upload to Google Cloud Storage
-            if self.storage_client:
+            bundle_blob_name = None
+            if self.bucket:
                 blob_name = f"videos/{request_id}/video_{request_id}.{format}"
                 gcs_url = self._upload_to_gcs(video_file, blob_name)
+                if cache_blob_name:
+                    self._store_cached_render(blob_name, cache_blob_name)
+                if include_artifacts:
+                    # The video is already uploaded, so a failed bundle only
+                    # drops the artifacts rather than failing the render
+                    try:
+                        bundle_blob_name = self._bundle_and_upload(render_output_dir, request_id)
+                    except Exception as e:
+                        log.error("Failed to upload render artifacts", error=str(e))
             else:
                 gcs_url = None
-                logger.warning("Google Cloud Storage not available, video not uploaded")
+                log.warning("Google Cloud Storage not available, video not uploaded")
             
             # Calculate metrics
             render_time = time.time() - start_time
             file_size = video_file.stat().st_size
             
-            # Cleanup temporary files
-            script_file.unlink(missing_ok=True)
-            
             result = {
                 'success': True,
+                'cached': False,
                 'request_id': request_id,
-                'video_file': str(video_file),
+                # The scratch copy is deleted before the response is sent;
+                # gcs_url is where the video lives
+                'video_file': None,
                 'gcs_url': gcs_url,
                 'blob_name': blob_name if gcs_url else None,
+                'bundle_gcs_url': f"gs://{self.bucket_name}/{bundle_blob_name}" if bundle_blob_name else None,
                 'file_size': file_size,
                 'render_time': render_time,
                 'quality': quality,
                 'format': format,
                 'scene_name': scene_name,
                 'timestamp': datetime.utcnow().isoformat(),
-                'stdout': process.stdout,
-                'stderr': process.stderr
+                'stdout': render['stdout'],
+                'stderr': render['stderr']
             }
             
-            logger.info(
+            log.info(
                 "Render completed successfully",
-                request_id=request_id,
                 render_time=render_time,
                 file_size=file_size,
                 gcs_url=gcs_url
@@ -259,9 +562,9 @@ class ManimRenderer:
             
             return result
             
-        except subprocess.TimeoutExpired:
+        except TimeoutError:
             error_msg = f"Rendering timeout after {config.MAX_RENDER_TIME} seconds"
-            logger.error("Render timeout", request_id=request_id)
+            log.error("Render timeout")
             self._report_metrics(time.time() - start_time, 0, False)
             return {
                 'success': False,
@@ -272,7 +575,7 @@ class ManimRenderer:
             
         except Exception as e:
             error_msg = f"Rendering failed: {str(e)}"
-            logger.error("Render error", request_id=request_id, error=error_msg)
+            log.error("Render error", error=error_msg)
             self._report_metrics(time.time() - start_time, 0, False)
             return {
                 'success': False,
@@ -282,20 +585,125 @@ class ManimRenderer:
             }
         
         finally:
-            # Cleanup
+            # The video has been uploaded (or the render failed), so drop
+            # the frames and intermediates to keep scratch usage constant
+            shutil.rmtree(self.output_dir / request_id, ignore_errors=True)
+    
+    def _bundle_and_upload(self, render_output_dir: Path, request_id: str) -> str:
+        """
+        Upload the whole render tree (video, partial movie files, frames) as
+        one tar.gz streamed straight into a resumable upload, so hundreds of
+        small files cost one upload instead of one request each
+        """
+        blob_name = f"bundles/{request_id}.tar.gz"
+        blob = self.bucket.blob(blob_name)
+        
+        gcs_file = blob.open('wb', chunk_size=config.BUNDLE_CHUNK_SIZE, content_type='application/gzip')
+        try:
+            self._write_bundle(gcs_file, render_output_dir, request_id)
+            gcs_file.close()
+        except BaseException:
+            # BlobWriter.close() finalizes the upload even after an error
+            # (it also runs on garbage collection), so let it commit and
+            # delete the truncated bundle rather than leave it in the bucket
+            try:
+                gcs_file.close()
+            except Exception:
+                pass
             try:
-                script_file = self.temp_dir / f"script_{request_id}.py"
-                script_file.unlink(missing_ok=True)
-            except:
+                blob.delete()
+            except NotFound:
                 pass
+            except Exception as e:
+                logger.warning("Failed to delete partial bundle", error=str(e), blob_name=blob_name)
+            raise
+        
+        logger.info("Render artifacts uploaded to GCS", blob_name=blob_name)
+        return blob_name
+    
+    def _write_bundle(self, gcs_file, render_output_dir: Path, request_id: str):
+        """Stream the render tree into gcs_file as a tar.gz"""
+        if not _PIGZ:
+            with tarfile.open(fileobj=gcs_file, mode='w|gz') as tar:
+                tar.add(str(render_output_dir), arcname=request_id)
+            return
+        
+        # Compress on all cores: tar into pigz's stdin while a thread pumps
+        # the compressed stream into the upload
+        pigz = subprocess.Popen(
+            [_PIGZ, '-p', str(os.cpu_count() or 1), '-c'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+        pump_errors = []
+        
+        def pump():
+            try:
+                shutil.copyfileobj(pigz.stdout, gcs_file, config.BUNDLE_CHUNK_SIZE)
+            except Exception as e:
+                # Unblock the tar writer instead of deadlocking on a full pipe
+                pump_errors.append(e)
+                pigz.kill()
+        
+        pump_thread = threading.Thread(target=pump)
+        pump_thread.start()
+        try:
+            with tarfile.open(fileobj=pigz.stdin, mode='w|') as tar:
+                tar.add(str(render_output_dir), arcname=request_id)
+            pigz.stdin.close()
+            pump_thread.join()
+            if pump_errors:
+                raise pump_errors[0]
+            if pigz.wait() != 0:
+                raise RuntimeError("pigz failed while bundling render artifacts")
+        except BaseException:
+            pigz.kill()
+            pigz.wait()
+            try:
+                pigz.stdin.close()
+            except OSError:
+                pass
+            pump_thread.join()
+            # A failed upload kills pigz, which reaches the tar writer as
+            # BrokenPipeError; surface the upload error instead
+            if pump_errors:
+                raise pump_errors[0]
+            raise
+    
+    def _lookup_cached_render(self, cache_blob_name: str) -> Optional[storage.Blob]:
+        """Return the cached render blob, or None on a miss or lookup failure"""
+        try:
+            return self.bucket.get_blob(cache_blob_name)
+        except Exception as e:
+            logger.warning("Render cache lookup failed", error=str(e), blob_name=cache_blob_name)
+            return None
+    
+    def _store_cached_render(self, blob_name: str, cache_blob_name: str):
+        """Copy an uploaded render into the cache with a server-side copy"""
+        try:
+            self.bucket.copy_blob(self.bucket.blob(blob_name), self.bucket, cache_blob_name)
+        except Exception as e:
+            logger.warning("Failed to cache render", error=str(e), blob_name=cache_blob_name)
     
     def _upload_to_gcs(self, local_file: Path, blob_name: str) -> str:
         """Upload file to Google Cloud Storage"""
         try:
-            bucket = self.storage_client.bucket(self.bucket_name)
-            blob = bucket.blob(blob_name)
-            
-            blob.upload_from_filename(str(local_file))
+            blob = self.bucket.blob(blob_name)
+            
+            if local_file.stat().st_size > config.UPLOAD_CHUNK_SIZE:
+                # Large videos go up as an XML multipart upload with the
+                # chunks sent in parallel instead of one sequential PUT
+                transfer_manager.upload_chunks_concurrently(
+                    str(local_file),
+                    blob,
+                    chunk_size=config.UPLOAD_CHUNK_SIZE,
+                    max_workers=config.UPLOAD_WORKERS,
+                    worker_type=transfer_manager.THREAD
+                )
+            else:
+                # Files above 8 MiB use a resumable upload in chunks of this size
+                blob.chunk_size = config.UPLOAD_RESUMABLE_CHUNK_SIZE
+                blob.upload_from_filename(str(local_file))
             
             # Make the blob publicly readable (optional)
             # blob.make_public()
@@ -310,74 +718,48 @@ class ManimRenderer:
             raise
     
     def _report_metrics(self, render_time: float, file_size: int, success: bool):
-        """Report custom metrics to Google Cloud Monitoring"""
-        if not monitoring_client:
-            return
-        
-        try:
-            project_name = f"projects/{config.PROJECT_ID}"
-            
-            # Create time series data
-            now = time.time()
-            seconds = int(now)
-            nanos = int((now - seconds) * 10 ** 9)
-            interval = monitoring_v3.TimeInterval({
-                "end_time": {"seconds": seconds, "nanos": nanos}
-            })
-            
-            # Render time metric
-            render_time_series = monitoring_v3.TimeSeries()
-            render_time_series.metric.type = "custom.googleapis.com/manim/render_time"
-            render_time_series.resource.type = "cloud_run_revision"
-            render_time_series.resource.labels["service_name"] = config.SERVICE_NAME
-            render_time_series.resource.labels["revision_name"] = config.REVISION
-            
-            point = monitoring_v3.Point()
-            point.value.double_value = render_time
-            point.interval = interval
-            render_time_series.points = [point]
-            
-            # Success rate metric
-            success_series = monitoring_v3.TimeSeries()
-            success_series.metric.type = "custom.googleapis.com/manim/success_rate"
-            success_series.resource.type = "cloud_run_revision"
-            success_series.resource.labels["service_name"] = config.SERVICE_NAME
-            success_series.resource.labels["revision_name"] = config.REVISION
-            
-            point = monitoring_v3.Point()
-            point.value.int64_value = 1 if success else 0
-            point.interval = interval
-            success_series.points = [point]
-            
-            # Send metrics
-            monitoring_client.create_time_series(
-                name=project_name,
-                time_series=[render_time_series, success_series]
-            )
-            
-        except Exception as e:
-            logger.error("Failed to report metrics", error=str(e))
+        """Queue custom metrics for the background Cloud Monitoring writer"""
+        _METRIC_QUEUE.put((render_time, file_size, success, time.time()))
 
 # Initialize renderer
 renderer = ManimRenderer()
 
-# Routes
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
+def _build_health_body() -> bytes:
+    return orjson.dumps({
         'status': 'healthy',
         'service': config.SERVICE_NAME,
         'revision': config.REVISION,
         'timestamp': datetime.utcnow().isoformat()
     })
 
+# Health probes are served from a prebuilt body; only the timestamp changes,
+# so a background thread re-stamps it once a second instead of per request
+_health_body = _build_health_body()
+
+def _refresh_health_body():
+    global _health_body
+    while True:
+        time.sleep(1)
+        _health_body = _build_health_body()
+
+threading.Thread(target=_refresh_health_body, name='health-refresher', daemon=True).start()
+
+_NOT_FOUND_BODY = orjson.dumps({'error': 'Endpoint not found'})
+_INTERNAL_ERROR_BODY = orjson.dumps({'error': 'Internal server error'})
+
+# Routes
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    return Response(_health_body, mimetype='application/json')
+
 @app.route('/render', methods=['POST'])
-def render_video():
+async def render_video():
     """Main rendering endpoint"""
     try:
         # Generate unique request ID
         request_id = str(uuid.uuid4())
+        log = logger.bind(request_id=request_id)
         
         # Parse request
         data = request.get_json()
@@ -391,23 +773,25 @@ def render_video():
         quality = data.get('quality', config.DEFAULT_QUALITY)
         format = data.get('format', config.DEFAULT_FORMAT)
         scene_name = data.get('scene_name')
+        include_artifacts = data.get('include_artifacts', False)
         
-        logger.info(
+        log.info(
             "Received render request",
-            request_id=request_id,
             quality=quality,
             format=format,
             scene_name=scene_name,
+            include_artifacts=include_artifacts,
             script_length=len(script_content)
         )
         
         # Render the script
-        result = renderer.render_script(
+        result = await renderer.render_script(
             script_content=script_content,
             request_id=request_id,
             quality=quality,
             format=format,
-            scene_name=scene_name
+            scene_name=scene_name,
+            include_artifacts=include_artifacts
         )
         
         if result['success']:
@@ -416,7 +800,7 @@ def render_video():
             return jsonify(result), 500
             
     except Exception as e:
-        logger.error("Render endpoint error", error=str(e))
+        log.error("Render endpoint error", error=str(e))
         return jsonify({
             'success': False,
             'error': f'Internal server error: {str(e)}',
@@ -434,13 +818,25 @@ def get_render_status(request_id: str):
 
 @app.errorhandler(404)
 def not_found(error):
-    return jsonify({'error': 'Endpoint not found'}), 404
+    return Response(_NOT_FOUND_BODY, status=404, mimetype='application/json')
 
 @app.errorhandler(500)
 def internal_error(error):
     logger.error("Internal server error", error=str(error))
-    return jsonify({'error': 'Internal server error'}), 500
+    return Response(_INTERNAL_ERROR_BODY, status=500, mimetype='application/json')
+
+def _setup_cloud_logging():
+    """Route stdlib logging to Cloud Logging once the client is available"""
+    cloud_logging_client = _get_logging_client()
+    if cloud_logging_client:
+        cloud_logging_client.setup_logging()
+
+# Attach the Cloud Logging handler in the background so the listener can bind
+# without waiting for the client
+threading.Thread(target=_setup_cloud_logging, name='cloud-logging-setup', daemon=True).start()
 
+# Local development only; containers run the app under gunicorn
+# (see gunicorn_conf.py)
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8080))
     debug = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
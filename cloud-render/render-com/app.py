@@ -6,70 +6,236 @@ A Flask application for rendering Manim scripts and returning videos directly
 
 import os
 import sys
+import asyncio
+import re
 import json
 import uuid
 import time
 import tempfile
 import subprocess
+import shutil
 import logging
+import threading
+import multiprocessing
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Any, Optional, Tuple
 import base64
+import hashlib
 
 from flask import Flask, request, jsonify, Response, send_file
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+import orjson
 import structlog
 
-# Configure structured logging
-structlog.configure(
-    processors=[
-        structlog.stdlib.filter_by_level,
-        structlog.stdlib.add_logger_name,
-        structlog.stdlib.add_log_level,
-        structlog.stdlib.PositionalArgumentsFormatter(),
-        structlog.processors.TimeStamper(fmt="iso"),
-        structlog.processors.StackInfoRenderer(),
-        structlog.processors.format_exc_info,
-        structlog.processors.UnicodeDecoder(),
-        structlog.processors.JSONRenderer()
-    ],
-    context_class=dict,
-    logger_factory=structlog.stdlib.LoggerFactory(),
-    wrapper_class=structlog.stdlib.BoundLogger,
-    cache_logger_on_first_use=True,
-)
+import render_worker
 
-logger = structlog.get_logger()
+# Structured logging is configured by render_worker so the render processes
+# log exactly like the web process
+render_worker.configure_logging()
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson's C encoder"""
+    
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(
+            obj,
+            default=self.default,
+            option=orjson.OPT_NON_STR_KEYS
+        ).decode('utf-8')
+    
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
 
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app)
+app.json = ORJSONProvider(app)
+CORS(app, expose_headers=['X-Request-Id', 'X-Render-Time', 'X-File-Size'])
 
 # Configuration
 class Config:
     """Application configuration"""
     SERVICE_NAME = os.getenv('RENDER_SERVICE_NAME', 'manim-renderer')
+    REVISION = os.getenv('RENDER_GIT_COMMIT', 'unknown')
     
-    # Directories
-    OUTPUT_DIR = Path('/app/output')
-    TEMP_DIR = Path('/app/temp')
+    # Directories. Render scratch lives under the system temp dir (honours
+    # TMPDIR). In this image /tmp is on the container's overlay filesystem,
+    # so only the location changed; set TMPDIR to a tmpfs mount to keep
+    # Manim's frame and mux IO in memory
+    SCRATCH_DIR = Path(tempfile.gettempdir()) / 'manim'
+    OUTPUT_DIR = SCRATCH_DIR / 'output'
+    TEMP_DIR = SCRATCH_DIR / 'temp'
     LOGS_DIR = Path('/app/logs')
     
     # Rendering settings
     MAX_RENDER_TIME = int(os.getenv('MAX_RENDER_TIME', '3600'))  # 1 hour
     DEFAULT_QUALITY = os.getenv('DEFAULT_QUALITY', 'medium_quality')
     DEFAULT_FORMAT = os.getenv('DEFAULT_FORMAT', 'mp4')
+    RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '2'))
+    SWEEP_INTERVAL = int(os.getenv('SWEEP_INTERVAL', '300'))  # 5 minutes
     
     # Render.com specific
     PORT = int(os.getenv('PORT', 8080))
 
 config = Config()
 
+# Shared logger with the process-wide context bound once; request handlers
+# bind request_id on top of it, and render workers get the same context
+_LOG_CONTEXT = {
+    'service': config.SERVICE_NAME,
+    'revision': config.REVISION
+}
+logger = structlog.get_logger().bind(**_LOG_CONTEXT)
+
 # Ensure directories exist
 for directory in [config.OUTPUT_DIR, config.TEMP_DIR, config.LOGS_DIR]:
     directory.mkdir(parents=True, exist_ok=True)
 
+# Finished renders by request ID, so /status and /download are O(1) lookups
+# instead of walking the output tree on every call
+_VIDEO_FILES: Dict[str, Path] = {}
+_VIDEO_FILES_LOCK = threading.Lock()
+
+def _remember_video_file(request_id: str, video_file: Path):
+    with _VIDEO_FILES_LOCK:
+        _VIDEO_FILES[request_id] = video_file
+
+def _discard_render(request_id: str):
+    """Forget a render and delete its output directory"""
+    with _VIDEO_FILES_LOCK:
+        _VIDEO_FILES.pop(request_id, None)
+    shutil.rmtree(config.OUTPUT_DIR / request_id, ignore_errors=True)
+
+def _find_video_file(request_id: str) -> Optional[Path]:
+    """Return the finished video for a request, if it still exists"""
+    with _VIDEO_FILES_LOCK:
+        video_file = _VIDEO_FILES.get(request_id)
+    if video_file is None:
+        # Rendered by another worker process; finished renders keep their
+        # video at the root of the request's output directory
+        video_file = next((config.OUTPUT_DIR / request_id).glob('video_*'), None)
+    if video_file is None or not video_file.is_file():
+        return None
+    return video_file
+
+def _video_etag(video_file: Path) -> str:
+    """Cheap strong ETag from the file's size and mtime, no content hashing"""
+    stat = video_file.stat()
+    return hashlib.sha256(f'{stat.st_size}||{stat.st_mtime_ns}'.encode()).hexdigest()
+
+def _sweep_scratch_dirs():
+    """Remove render leftovers older than twice the render timeout"""
+    while True:
+        time.sleep(config.SWEEP_INTERVAL)
+        cutoff = time.time() - config.MAX_RENDER_TIME * 2
+        for directory in [config.OUTPUT_DIR, config.TEMP_DIR]:
+            # A failed listing skips this pass instead of ending the thread
+            try:
+                paths = list(directory.iterdir())
+            except OSError as e:
+                logger.warning("Failed to list scratch directory", path=str(directory), error=str(e))
+                continue
+            for path in paths:
+                try:
+                    if path.stat().st_mtime >= cutoff:
+                        continue
+                    if directory == config.OUTPUT_DIR:
+                        _discard_render(path.name)
+                    elif path.is_dir():
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        path.unlink(missing_ok=True)
+                    logger.info("Swept stale render data", path=str(path))
+                except OSError as e:
+                    logger.warning("Failed to sweep render data", path=str(path), error=str(e))
+
+# Background sweeper so scratch usage is bounded by concurrent jobs rather
+# than total jobs served, even when a render dies before its own cleanup
+threading.Thread(target=_sweep_scratch_dirs, name='scratch-sweeper', daemon=True).start()
+
+# Each render runs in its own process from a forkserver that preloads manim
+# and render_worker, so it starts warm and single-threaded rather than as a
+# fork of this threaded web worker. Nothing a script changes in Manim
+# outlives its render, and a render that dies or hangs is killed on its own
+# without affecting the others.
+_RENDER_CONTEXT = multiprocessing.get_context('forkserver')
+_RENDER_CONTEXT.set_forkserver_preload(['manim', 'render_worker'])
+_RENDER_SLOTS = threading.BoundedSemaphore(config.RENDER_WORKERS)
+_RENDER_KILL_GRACE = 30  # seconds past MAX_RENDER_TIME before the kill
+
+def _run_render_process(*args) -> Dict[str, Any]:
+    """Run render_worker.render_in_child in a fresh process under a hard deadline"""
+    with _RENDER_SLOTS:
+        parent_conn, child_conn = _RENDER_CONTEXT.Pipe(duplex=False)
+        process = _RENDER_CONTEXT.Process(
+            target=render_worker.run_render,
+            args=(child_conn, _LOG_CONTEXT, *args),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        try:
+            # The child's own SIGALRM can be disabled by the script, so the
+            # deadline is enforced here as well
+            if not parent_conn.poll(config.MAX_RENDER_TIME + _RENDER_KILL_GRACE):
+                process.kill()
+                raise TimeoutError(f"Rendering timeout after {config.MAX_RENDER_TIME} seconds")
+            try:
+                status, payload = parent_conn.recv()
+            except EOFError:
+                process.join()
+                raise RuntimeError(
+                    f"Render worker process died unexpectedly (exit code {process.exitcode})"
+                )
+        finally:
+            parent_conn.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+                process.join()
+    
+    if status == 'timeout':
+        raise TimeoutError(f"Rendering timeout after {config.MAX_RENDER_TIME} seconds")
+    if status == 'error':
+        raise RuntimeError(payload)
+    return payload
+
+def _detect_hw_encoder() -> Optional[str]:
+    """Return the hardware H.264 encoder ffmpeg can use on this host, if any"""
+    if Path('/dev/nvidia0').exists():
+        candidate = 'h264_nvenc'
+    elif Path('/dev/dri/renderD128').exists():
+        candidate = 'h264_vaapi'
+    else:
+        return None
+    
+    try:
+        encoders = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-encoders'],
+            capture_output=True,
+            text=True,
+            timeout=10
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    
+    return candidate if candidate in encoders else None
+
+# Detected once at startup and passed to each render
+_HW_ENCODER = _detect_hw_encoder()
+
+logger.info("Video encoder selected", hw_encoder=_HW_ENCODER or 'none')
+
+# Script validation patterns, compiled once so each check is a single scan.
+# Dangerous tokens match anywhere, like the substring checks they replace,
+# so 'open' still catches os.popen and 'exec' catches the os.exec* family
+_DANGEROUS_RE = re.compile(
+    r'subprocess|os\.system|eval|exec\w*|popen|open|__import__|compile|globals|locals'
+)
+_MANIM_IMPORT_RE = re.compile(r'^\s*(?:from\s+manim\s+import|import\s+manim\b)', re.M)
+_SCENE_CLASS_RE = re.compile(r'class\s+\w+\s*\([^)]*Scene')
+
 class ManimRenderer:
     """
     Handles Manim script rendering and returns videos directly
@@ -85,21 +251,16 @@ class ManimRenderer:
         """
         try:
             # Basic security checks
-            dangerous_imports = [
-                'subprocess', 'os.system', 'eval', 'exec', 'open',
-                '__import__', 'compile', 'globals', 'locals'
-            ]
-            
-            for dangerous in dangerous_imports:
-                if dangerous in script_content:
-                    return False, f"Dangerous function/import detected: {dangerous}"
+            dangerous = _DANGEROUS_RE.search(script_content)
+            if dangerous:
+                return False, f"Dangerous function/import detected: {dangerous.group(0)}"
             
             # Check for required Manim imports
-            if 'from manim import' not in script_content and 'import manim' not in script_content:
+            if not _MANIM_IMPORT_RE.search(script_content):
                 return False, "Script must import manim"
             
             # Check for Scene class
-            if 'class' not in script_content or 'Scene' not in script_content:
+            if not _SCENE_CLASS_RE.search(script_content):
                 return False, "Script must contain a Scene class"
             
             return True, "Script validation passed"
@@ -107,14 +268,13 @@ class ManimRenderer:
         except Exception as e:
             return False, f"Validation error: {str(e)}"
     
-    def render_script(
+    async def render_script(
         self, 
         script_content: str, 
         request_id: str,
         quality: str = None,
         format: str = None,
-        scene_name: str = None,
-        return_base64: bool = False
+        scene_name: str = None
     ) -> Dict[str, Any]:
         """
         Render a Manim script and return video data directly
@@ -122,14 +282,13 @@ class ManimRenderer:
         start_time = time.time()
         quality = quality or config.DEFAULT_QUALITY
         format = format or config.DEFAULT_FORMAT
+        log = logger.bind(request_id=request_id)
         
-        logger.info(
+        log.info(
             "Starting render",
-            request_id=request_id,
             quality=quality,
             format=format,
-            scene_name=scene_name,
-            return_base64=return_base64
+            scene_name=scene_name
         )
         
         try:
@@ -138,52 +297,39 @@ class ManimRenderer:
             if not is_valid:
                 raise ValueError(f"Script validation failed: {validation_message}")
             
-            # Create temporary script file
-            script_file = self.temp_dir / f"script_{request_id}.py"
-            with open(script_file, 'w', encoding='utf-8') as f:
-                f.write(script_content)
-            
             # Prepare output directory for this render
             render_output_dir = self.output_dir / request_id
             render_output_dir.mkdir(exist_ok=True)
             
-            # Build manim command
-            cmd = [
-                'manim',
-                str(script_file),
-                '--output_file', f'video_{request_id}',
-                '--media_dir', str(render_output_dir),
-                f'--{quality}',
-                '--format', format,
-                '--disable_caching'
-            ]
-            
-            if scene_name:
-                cmd.append(scene_name)
-            
-            logger.info("Executing manim command", command=' '.join(cmd))
-            
-            # Execute manim rendering
-            process = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=config.MAX_RENDER_TIME,
-                cwd=str(self.temp_dir)
+            # Render in a separate process, waited on from a thread so the
+            # request's event loop is not blocked
+            loop = asyncio.get_running_loop()
+            render = await loop.run_in_executor(
+                None,
+                _run_render_process,
+                script_content,
+                str(render_output_dir),
+                request_id,
+                quality,
+                format,
+                scene_name,
+                str(self.temp_dir),
+                config.MAX_RENDER_TIME,
+                _HW_ENCODER
             )
-            
-            if process.returncode != 0:
-                error_msg = f"Manim rendering failed: {process.stderr}"
-                logger.error("Render failed", error=error_msg, stdout=process.stdout)
-                raise RuntimeError(error_msg)
-            
-            # Find the rendered video file
-            video_files = list(render_output_dir.rglob(f'*.{format}'))
-            if not video_files:
-                raise RuntimeError("No video file found after rendering")
-            
-            video_file = video_files[0]  # Take the first video file found
-            
+
+            video_file = Path(render['video_file'])
+
+            # Keep only the final video for /download; frames, partial movie
+            # files and Tex/text caches are dead weight once muxing is done
+            final_video_file = render_output_dir / video_file.name
+            video_file.replace(final_video_file)
+            video_file = final_video_file
+            for path in render_output_dir.iterdir():
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+            _remember_video_file(request_id, video_file)
+
             # Calculate metrics
             render_time = time.time() - start_time
             file_size = video_file.stat().st_size
@@ -199,23 +345,12 @@ class ManimRenderer:
                 'format': format,
                 'scene_name': scene_name,
                 'timestamp': datetime.utcnow().isoformat(),
-                'stdout': process.stdout,
-                'stderr': process.stderr
+                'stdout': render['stdout'],
+                'stderr': render['stderr']
             }
             
-            # Add base64 data if requested
-            if return_base64:
-                with open(video_file, 'rb') as f:
-                    video_data = f.read()
-                    result['video_base64'] = base64.b64encode(video_data).decode('utf-8')
-                    result['video_size_mb'] = len(video_data) / (1024 * 1024)
-            
-            # Cleanup temporary files
-            script_file.unlink(missing_ok=True)
-            
-            logger.info(
+            log.info(
                 "Render completed successfully",
-                request_id=request_id,
                 render_time=render_time,
                 file_size=file_size,
                 video_file=str(video_file)
@@ -223,9 +358,10 @@ class ManimRenderer:
             
             return result
             
-        except subprocess.TimeoutExpired:
+        except TimeoutError:
             error_msg = f"Rendering timeout after {config.MAX_RENDER_TIME} seconds"
-            logger.error("Render timeout", request_id=request_id)
+            log.error("Render timeout")
+            _discard_render(request_id)
             return {
                 'success': False,
                 'error': error_msg,
@@ -235,42 +371,70 @@ class ManimRenderer:
             
         except Exception as e:
             error_msg = f"Rendering failed: {str(e)}"
-            logger.error("Render error", request_id=request_id, error=error_msg)
+            log.error("Render error", error=error_msg)
+            _discard_render(request_id)
             return {
                 'success': False,
                 'error': error_msg,
                 'request_id': request_id,
                 'timestamp': datetime.utcnow().isoformat()
             }
-        
-        finally:
-            # Cleanup
-            try:
-                script_file = self.temp_dir / f"script_{request_id}.py"
-                script_file.unlink(missing_ok=True)
-            except:
-                pass
 
 # Initialize renderer
 renderer = ManimRenderer()
 
-# Routes
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
+# Read size for the legacy base64 response; a multiple of 3 so every chunk
+# encodes without padding and the pieces concatenate into one valid string
+_BASE64_READ_SIZE = 48 * 1024
+
+def _iter_base64_json(result: Dict[str, Any], video_file: Path):
+    """
+    Stream the deprecated return_base64 JSON body, encoding the video one
+    chunk at a time so memory stays flat regardless of the video size
+    """
+    envelope = dict(result, video_size_mb=result['file_size'] / (1024 * 1024))
+    yield orjson.dumps(envelope)[:-1] + b',"video_base64":"'
+    with open(video_file, 'rb') as f:
+        while chunk := f.read(_BASE64_READ_SIZE):
+            yield base64.b64encode(chunk)
+    yield b'"}'
+
+def _build_health_body() -> bytes:
+    return orjson.dumps({
         'status': 'healthy',
         'service': config.SERVICE_NAME,
         'timestamp': datetime.utcnow().isoformat(),
         'storage': 'direct_return'
     })
 
+# Health probes are served from a prebuilt body; only the timestamp changes,
+# so a background thread re-stamps it once a second instead of per request
+_health_body = _build_health_body()
+
+def _refresh_health_body():
+    global _health_body
+    while True:
+        time.sleep(1)
+        _health_body = _build_health_body()
+
+threading.Thread(target=_refresh_health_body, name='health-refresher', daemon=True).start()
+
+_NOT_FOUND_BODY = orjson.dumps({'error': 'Endpoint not found'})
+_INTERNAL_ERROR_BODY = orjson.dumps({'error': 'Internal server error'})
+
+# Routes
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    return Response(_health_body, mimetype='application/json')
+
 @app.route('/render', methods=['POST'])
-def render_video():
+async def render_video():
     """Main rendering endpoint - returns video data directly"""
     try:
         # Generate unique request ID
         request_id = str(uuid.uuid4())
+        log = logger.bind(request_id=request_id)
         
         # Parse request
         data = request.get_json()
@@ -285,34 +449,60 @@ def render_video():
         format = data.get('format', config.DEFAULT_FORMAT)
         scene_name = data.get('scene_name')
         return_base64 = data.get('return_base64', False)
+        return_video = data.get('return_video', False)
+        
+        if return_base64:
+            log.warning("return_base64 is deprecated, use return_video or /download instead")
         
-        logger.info(
+        log.info(
             "Received render request",
-            request_id=request_id,
             quality=quality,
             format=format,
             scene_name=scene_name,
             return_base64=return_base64,
+            return_video=return_video,
             script_length=len(script_content)
         )
         
         # Render the script
-        result = renderer.render_script(
+        result = await renderer.render_script(
             script_content=script_content,
             request_id=request_id,
             quality=quality,
             format=format,
-            scene_name=scene_name,
-            return_base64=return_base64
+            scene_name=scene_name
         )
         
-        if result['success']:
-            return jsonify(result), 200
-        else:
+        if not result['success']:
             return jsonify(result), 500
+        
+        if return_video:
+            # Stream the video itself (sendfile where the server supports it)
+            # and carry the render metadata in headers
+            response = send_file(
+                result['video_file_path'],
+                mimetype=f"video/{result['format']}",
+                conditional=True,
+                etag=_video_etag(Path(result['video_file_path']))
+            )
+            response.headers['X-Request-Id'] = request_id
+            response.headers['X-Render-Time'] = str(result['render_time'])
+            response.headers['X-File-Size'] = str(result['file_size'])
+            # The client already has the video, so drop it once the body
+            # has been fully sent
+            response.call_on_close(lambda: _discard_render(request_id))
+            return response
+        
+        if return_base64:
+            return Response(
+                _iter_base64_json(result, Path(result['video_file_path'])),
+                mimetype='application/json'
+            )
+        
+        return jsonify(result), 200
             
     except Exception as e:
-        logger.error("Render endpoint error", error=str(e))
+        log.error("Render endpoint error", error=str(e))
         return jsonify({
             'success': False,
             'error': f'Internal server error: {str(e)}',
@@ -322,26 +512,29 @@ def render_video():
 @app.route('/download/<request_id>', methods=['GET'])
 def download_video(request_id: str):
     """Download video file directly"""
+    log = logger.bind(request_id=request_id)
     try:
         # Find the video file
-        render_output_dir = config.OUTPUT_DIR / request_id
-        video_files = list(render_output_dir.rglob('*.mp4'))
+        video_file = _find_video_file(request_id)
         
-        if not video_files:
+        if not video_file:
             return jsonify({'error': 'Video file not found'}), 404
         
-        video_file = video_files[0]
-        
-        # Return the file
+        # Return the file; Range and If-None-Match/If-Modified-Since are
+        # honoured so interrupted downloads can resume
         return send_file(
             video_file,
             as_attachment=True,
-            download_name=f'manim_video_{request_id}.mp4',
-            mimetype='video/mp4'
+            download_name=f'manim_video_{request_id}{video_file.suffix}',
+            mimetype=f'video/{video_file.suffix.lstrip(".")}',
+            conditional=True,
+            etag=_video_etag(video_file),
+            last_modified=video_file.stat().st_mtime,
+            max_age=3600
         )
         
     except Exception as e:
-        logger.error("Download error", error=str(e), request_id=request_id)
+        log.error("Download error", error=str(e))
         return jsonify({'error': f'Download failed: {str(e)}'}), 500
 
 @app.route('/status/<request_id>', methods=['GET'])
@@ -349,11 +542,9 @@ def get_render_status(request_id: str):
     """Get rendering status"""
     try:
         # Check if video file exists
-        render_output_dir = config.OUTPUT_DIR / request_id
-        video_files = list(render_output_dir.rglob('*.mp4'))
+        video_file = _find_video_file(request_id)
         
-        if video_files:
-            video_file = video_files[0]
+        if video_file:
             file_size = video_file.stat().st_size
             return jsonify({
                 'request_id': request_id,
@@ -377,13 +568,15 @@ def get_render_status(request_id: str):
 
 @app.errorhandler(404)
 def not_found(error):
-    return jsonify({'error': 'Endpoint not found'}), 404
+    return Response(_NOT_FOUND_BODY, status=404, mimetype='application/json')
 
 @app.errorhandler(500)
 def internal_error(error):
     logger.error("Internal server error", error=str(error))
-    return jsonify({'error': 'Internal server error'}), 500
+    return Response(_INTERNAL_ERROR_BODY, status=500, mimetype='application/json')
 
+# Local development only; containers run the app under gunicorn
+# (see gunicorn_conf.py)
 if __name__ == '__main__':
     port = config.PORT
     debug = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
@@ -0,0 +1,28 @@
+"""
+Gunicorn configuration for the Manim rendering service
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+
+# Flask is a WSGI app, so threaded workers give real concurrency: while one
+# thread awaits a render in the Manim pool, others keep serving /health
+# and status requests
+worker_class = 'gthread'
+# One worker by default: each worker owns its own Manim render pool, and
+# os.cpu_count() reports the host's cores inside a container. Raise
+# WEB_CONCURRENCY to scale up.
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+# Renders can legitimately hold a request for up to MAX_RENDER_TIME
+timeout = int(os.getenv('MAX_RENDER_TIME', '3600')) + 60
+graceful_timeout = 30
+
+# Longer than the load balancer's idle timeout so it never reuses a
+# connection gunicorn has already closed
+keepalive = 75
+
+accesslog = '-'
+errorlog = '-'
@@ -0,0 +1,256 @@
+"""
+Manim render worker
+Code that runs inside the per-render processes. Importing this module has no
+side effects (no threads, clients or processes), so the forkserver can preload
+it and every render gets a fresh child forked from a warm, single-threaded
+parent.
+"""
+
+import os
+import io
+import signal
+import logging
+import contextlib
+import traceback
+import subprocess
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+import orjson
+import structlog
+
+logger = structlog.get_logger()
+
+# Manim config quality names for the CLI-style quality flags
+_MANIM_QUALITIES = {
+    'l': 'low_quality',
+    'm': 'medium_quality',
+    'h': 'high_quality',
+    'p': 'production_quality',
+    'k': 'fourk_quality'
+}
+
+# High resolution renders are dominated by the H.264 encode, so only those
+# go through PNG frames and the hardware encoder
+_HW_ENCODE_QUALITIES = ('p', 'k')
+
+def _add_severity(logger, method_name, event_dict):
+    """Mirror the level as `severity` so Cloud Logging grades stdout entries"""
+    event_dict['severity'] = event_dict['level'].upper()
+    return event_dict
+
+def configure_logging():
+    """
+    Configure structured logging for the web process and render workers.
+    The filtering bound logger drops sub-INFO calls with a single level check
+    before any processor runs, and orjson renders each event straight to
+    bytes on stdout
+    """
+    structlog.configure(
+        processors=[
+            structlog.processors.add_log_level,
+            _add_severity,
+            structlog.processors.TimeStamper(fmt="iso"),
+            structlog.processors.StackInfoRenderer(),
+            structlog.processors.format_exc_info,
+            structlog.processors.UnicodeDecoder(),
+            structlog.processors.JSONRenderer(serializer=orjson.dumps)
+        ],
+        context_class=dict,
+        logger_factory=structlog.BytesLoggerFactory(),
+        wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
+        cache_logger_on_first_use=True,
+    )
+
+def init_worker(log_context: Dict[str, Any]):
+    """Set up logging in a render process with the web process's context"""
+    global logger
+    configure_logging()
+    logger = structlog.get_logger().bind(**log_context)
+
+def _encode_frames(frames_dir: Path, frame_rate: float, video_file: Path, hw_encoder: str):
+    """Encode a rendered PNG frame sequence to MP4 on the hardware encoder"""
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error']
+    if hw_encoder == 'h264_vaapi':
+        cmd += ['-vaapi_device', '/dev/dri/renderD128']
+    cmd += [
+        '-framerate', f'{frame_rate:g}',
+        '-pattern_type', 'glob',
+        '-i', str(frames_dir / '*.png')
+    ]
+    if hw_encoder == 'h264_vaapi':
+        cmd += ['-vf', 'format=nv12,hwupload', '-c:v', 'h264_vaapi']
+    else:
+        cmd += ['-c:v', 'h264_nvenc', '-preset', 'p4', '-pix_fmt', 'yuv420p']
+    cmd += ['-b:v', '8M', '-movflags', '+faststart', str(video_file)]
+
+    video_file.parent.mkdir(parents=True, exist_ok=True)
+    process = subprocess.run(cmd, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Hardware encoding failed: {process.stderr}")
+
+def _move_moov_to_front(video_file: Path):
+    """Remux an MP4 with +faststart so playback can start before download ends"""
+    remuxed_file = video_file.with_name(f"{video_file.stem}.faststart.mp4")
+    process = subprocess.run(
+        [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-i', str(video_file),
+            '-c', 'copy',
+            '-movflags', '+faststart',
+            str(remuxed_file)
+        ],
+        capture_output=True,
+        text=True
+    )
+    if process.returncode == 0:
+        remuxed_file.replace(video_file)
+    else:
+        remuxed_file.unlink(missing_ok=True)
+        logger.warning("Faststart remux failed", error=process.stderr)
+
+def _raise_render_timeout(signum, frame):
+    raise TimeoutError("Rendering timeout")
+
+def _find_scene_class(namespace: Dict[str, Any], module_name: str, scene_name: Optional[str]):
+    """Pick the Scene subclass to render from an executed script namespace"""
+    from manim import Scene
+
+    scene_classes = [
+        obj for obj in namespace.values()
+        if isinstance(obj, type) and issubclass(obj, Scene) and obj.__module__ == module_name
+    ]
+
+    if scene_name:
+        for scene_class in scene_classes:
+            if scene_class.__name__ == scene_name:
+                return scene_class
+        raise RuntimeError(f"Scene {scene_name} not found in script")
+
+    if not scene_classes:
+        raise RuntimeError("No Scene class found in script")
+
+    return scene_classes[0]  # First scene defined in the script
+
+def render_in_child(
+    script_content: str,
+    render_output_dir: str,
+    request_id: str,
+    quality_flag: str,
+    format: str,
+    scene_name: Optional[str],
+    cwd: str,
+    max_render_time: int,
+    hw_encoder: Optional[str]
+) -> Dict[str, Any]:
+    """
+    Render a single script inside a render process.
+
+    Executes the script and renders its scene through Manim's Python API,
+    so nothing is re-imported or re-parsed by a CLI per request. Each
+    render gets its own process, so whatever a script changes in Manim's
+    classes or module state dies with it.
+    """
+    from manim import config as manim_config, tempconfig
+
+    # With a hardware encoder, Manim only writes PNG frames and ffmpeg
+    # encodes them instead of Manim's software x264 encode
+    hw_encode = (
+        hw_encoder is not None
+        and format == 'mp4'
+        and quality_flag in _HW_ENCODE_QUALITIES
+    )
+
+    module_name = f'script_{request_id}'
+    render_config = {
+        'quality': _MANIM_QUALITIES.get(quality_flag, 'medium_quality'),
+        'format': 'png' if hw_encode else format,
+        'output_file': f'video_{request_id}',
+        'media_dir': render_output_dir,
+        'input_file': f'{module_name}.py',
+        'disable_caching': True
+    }
+    if hw_encode:
+        # Wide zero padding keeps PNG frame names in glob order for ffmpeg
+        render_config['zero_pad'] = 9
+
+    log = logger.bind(request_id=request_id)
+    log.info(
+        "Rendering in manim worker",
+        scene_name=scene_name,
+        hw_encode=hw_encode
+    )
+
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    video_file = None
+
+    # The render runs on this process's main thread, so SIGALRM ends it
+    # cleanly at the deadline. A script can disable the alarm, so the web
+    # process also kills this process once the deadline plus a grace passes.
+    signal.signal(signal.SIGALRM, _raise_render_timeout)
+    signal.alarm(max_render_time)
+    try:
+        os.chdir(cwd)
+        with tempconfig(render_config), \
+                contextlib.redirect_stdout(stdout), \
+                contextlib.redirect_stderr(stderr):
+            namespace = {'__name__': module_name}
+            exec(compile(script_content, f'<{module_name}>', 'exec'), namespace)
+            scene = _find_scene_class(namespace, module_name, scene_name)()
+            scene.render()
+
+            if hw_encode:
+                video_file = Path(
+                    manim_config.get_dir('video_dir', module_name=module_name)
+                ) / f"video_{request_id}.mp4"
+                frames_dir = Path(manim_config.get_dir('images_dir', module_name=module_name))
+                frame_rate = manim_config.frame_rate
+            else:
+                video_file = Path(scene.renderer.file_writer.movie_file_path)
+
+        if hw_encode:
+            _encode_frames(frames_dir, frame_rate, video_file, hw_encoder)
+        elif format == 'mp4' and video_file.exists():
+            _move_moov_to_front(video_file)
+    except TimeoutError:
+        raise
+    except BaseException:
+        # Re-raise as a plain RuntimeError so arbitrary exceptions from user
+        # scripts always survive pickling back to the parent. BaseException
+        # covers exit()/sys.exit(), whose SystemExit would otherwise escape
+        # every handler in the parent and take the web worker down with it
+        error_msg = f"Manim rendering failed: {traceback.format_exc()}"
+        log.error("Render failed", error=error_msg, stdout=stdout.getvalue())
+        raise RuntimeError(error_msg)
+    finally:
+        signal.alarm(0)
+
+    if video_file is None or not video_file.exists():
+        # Fall back to searching the media tree for the rendered video
+        video_files = list(Path(render_output_dir).rglob(f'*.{format}'))
+        if not video_files:
+            raise RuntimeError("No video file found after rendering")
+        video_file = video_files[0]  # Take the first video file found
+
+    return {
+        'video_file': str(video_file),
+        'stdout': stdout.getvalue(),
+        'stderr': stderr.getvalue()
+    }
+
+def run_render(conn: Connection, log_context: Dict[str, Any], *args):
+    """
+    Process target: render and send ('ok', result), ('timeout', None) or
+    ('error', message) back to the web process over conn
+    """
+    init_worker(log_context)
+    try:
+        message = ('ok', render_in_child(*args))
+    except TimeoutError:
+        message = ('timeout', None)
+    except BaseException as e:
+        message = ('error', str(e))
+    conn.send(message)
+    conn.close()